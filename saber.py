@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from src.globals import TOOL_NAME, P, CONFIG_PATH, ERR_CODES
+
+
+_UNCOMPLETED_KEYS = ("RUNNING_JOBS", "WAITING_JOBS", "QUEUED_JOBS", "NEW_JOBS")
 
 
 def print_example():
@@ -10,18 +16,182 @@ def print_example():
 
 
 
+def print_json(results: dict):
+    try:
+        import orjson  # optional, faster serializer
+    except ImportError:
+        import json
+        print(json.dumps(results, indent=2, sort_keys=False))
+    else:
+        print(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
+
+
+
+def _empty_bucket() -> dict:
+    return {
+        "SUCCESSFUL_JOBS": {}, 
+        "RUNNING_JOBS": {},
+        "QUEUED_JOBS": {},
+        "NEW_JOBS": {},
+        "WAITING_JOBS": {},
+        "FAILED_JOBS": {}
+    }
+
+
+
+def _merge_results(bucket: dict, pre_results: dict) -> None:
+    for key in ["SUCCESSFUL_JOBS", "RUNNING_JOBS", "FAILED_JOBS", "WAITING_JOBS", "QUEUED_JOBS", "NEW_JOBS"]:
+        if key in pre_results and isinstance(pre_results[key], dict):
+            bucket[key].update(pre_results[key])
+
+
+
+def run_instance(useg: dict, logger, is_last: bool, galaxy_instances: list) -> tuple:
+    '''
+    Run the test workflow on every endpoint of a single Galaxy instance.
+
+    :param useg: Instance configuration, already merged with the global settings.
+    :type useg: dict
+    :param logger: Logger shared between the instances.
+    :type logger: CustomLogger
+    :param is_last: Whether this is the last instance in the configuration.
+    :type is_last: bool
+    :param galaxy_instances: Collects the GalaxyTest objects, to clean them up if interrupted.
+    :type galaxy_instances: list
+    :return: Instance name, its results and the kind of the first error ('api', 'gal' or None),
+             also set when a single endpoint failed.
+    :rtype: tuple
+    '''
+    from requests.exceptions import Timeout
+    from src.bioblend_testjobs import GalaxyTest, ConnectionError, WFPathError
+
+    results = defaultdict(_empty_bucket)
+
+    galaxy_instance = GalaxyTest(
+        useg['url'], 
+        useg['api'], 
+        useg.get('email', None), 
+        useg.get('password', None), 
+        useg, 
+        logger
+        )
+    galaxy_instances.append(galaxy_instance)
+
+    error = None
+    try:
+        input = galaxy_instance.test_job_set_up()
+
+    except WFPathError as e:
+        logger.error(e)
+        logger.warning(f"Exiting with error: {ERR_CODES['path']}")
+        galaxy_instance.clean_up()
+        raise
+    except (ConnectionError, Timeout) as e:
+        logger.warning(f"Connection Error while testing {useg['name']}:")
+        logger.warning(f"{e}")
+        error = 'api'
+    except Exception as e:
+        logger.warning(f"Error: {e}")
+        error = 'gal'
+
+    if error is not None:
+        galaxy_instance.clean_up()
+        if not is_last:
+            logger.warning("Skipping to the next instance")
+        return useg['name'], dict(results), error
+
+    # Endpoints are switched and invoked one at a time, since the endpoint is a user
+    # preference, while the monitoring of the invocations overlaps in the pool
+    with ThreadPoolExecutor(max_workers=max(1, len(useg['endpoints']))) as endpoint_executor:
+        monitors = []
+        for pe in useg['endpoints']:
+            try:
+                galaxy_instance.switch_pulsar(pe)
+                compute_id = GalaxyTest.canonical_endpoint(pe)
+
+                results.setdefault(compute_id, _empty_bucket())  # Reported even if the test fails
+
+                invocation_id = galaxy_instance.invoke_workflow(workflow_input = input)
+                # Scheduling and monitoring share the invocation timeout
+                if not galaxy_instance.wait_for_scheduling(invocation_id):
+                    # Jobs still "new" would follow the next endpoint, cancel them and report them as pending
+                    logger.warning(f"Jobs of {compute_id} were not scheduled in time, skipping the endpoint")
+                    _merge_results(results[compute_id], galaxy_instance.abort_invocation(invocation_id, pe))
+                    continue
+                monitors.append((pe, endpoint_executor.submit(galaxy_instance.monitor_invocation, invocation_id, pe)))
+
+            except (ConnectionError, Timeout) as e:
+                logger.warning(f"A Connection error occurred while testing {pe}:")
+                logger.warning(f"{e}")
+                logger.warning("Continuing...")
+                error = error or 'api'
+
+            except Exception as e:
+                logger.warning(f"An error occurred while testing {pe}:")
+                logger.warning(f"{e}")
+                logger.warning("Continuing...")
+                error = error or 'gal'
+
+        for pe, monitor in monitors:
+            compute_id = GalaxyTest.canonical_endpoint(pe)
+            try:
+                _merge_results(results[compute_id], monitor.result())
+
+            except (ConnectionError, Timeout) as e:
+                logger.warning(f"A Connection error occurred while testing {pe}:")
+                logger.warning(f"{e}")
+                logger.warning("Continuing...")
+                error = error or 'api'
+
+            except Exception as e:
+                logger.warning(f"An error occurred while testing {pe}:")
+                logger.warning(f"{e}")
+                logger.warning("Continuing...")
+                error = error or 'gal'
+
+    try:    
+        galaxy_instance.clean_up()
+        galaxy_instance.switch_pulsar(useg['default_compute_id'])
+
+    except Exception as e:  # ConnectionError included
+        logger.warning(f"An error occurred while cleaning up:")
+        logger.warning(f"{e}")
+        logger.warning("Continuing...")
+
+    # An endpoint that could not be tested must not end in a passing check
+    return useg['name'], dict(results), error
+
+
+
+def stop_instances(executor, galaxy_instances: list):
+    '''
+    Stop the running instance tests, wait for their threads, cancel the
+    pending invocations and clean up.
+    '''
+    for galaxy_instance in galaxy_instances:
+        galaxy_instance.interrupt()
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+    for galaxy_instance in galaxy_instances:
+        galaxy_instance.cancel_invocations()
+        try:
+            galaxy_instance.clean_up()
+        except Exception as e:
+            galaxy_instance.logger.warning(f"An error occurred while cleaning up: {e}")
+
+
+
 def main():
-    from datetime import timedelta
     from src.logger import CustomLogger
     from src.args import Parser, datetime
     from src.secure_config import SecureConfig
-    from src.bioblend_testjobs import GalaxyTest, json, ConnectionError, WFPathError
-    from src.globals import TOOL_NAME, P, CONFIG_PATH, ERR_CODES
 
 
-    results = dict()
+    results = defaultdict(dict)
     conn_rr = False
     exc = False
+    executor = None
+    galaxy_instances = []
 
     try:
         args = Parser(P, CONFIG_PATH).arguments()
@@ -71,6 +241,9 @@ def main():
         logger.error(f"An error occurred with configuration: {e}")
         sys.exit(ERR_CODES['path'])
 
+    # Heavy (bioblend), imported once the arguments are parsed so --help stays fast
+    from src.bioblend_testjobs import WFPathError
+
     try:
         config = safe_config.load_config()
         config["config_path"] = str(safe_config.get_config_path())
@@ -82,133 +255,72 @@ def main():
             config["date"] = {"sDATETIME": start_d, "nDATETIME": string}
 
     
-        for i in range(len(config['usegalaxy_instances'])):
-
-            useg = dict(config['usegalaxy_instances'][i])
-            copyconf = config.copy()
-            copyconf.pop("usegalaxy_instances", None)
-            copyconf.update(useg)
-            useg = copyconf
-
-            galaxy_instance = GalaxyTest(
-                useg['url'], 
-                useg['api'], 
-                useg.get('email', None), 
-                useg.get('password', None), 
-                useg, 
-                logger
-                )
+        instances = config['usegalaxy_instances']
+        last_idx = len(instances) - 1
+        executor = ThreadPoolExecutor(max_workers=max(1, min(32, len(instances))))
+        futures = []
+        # Global settings, overridden by each instance's own values
+        base_cfg = {k: v for k, v in config.items() if k != "usegalaxy_instances"}
+        for i, raw in enumerate(instances):
 
-            try:
-                input = galaxy_instance.test_job_set_up()
+            useg = base_cfg | raw
+
+            is_last = i == last_idx
+            futures.append(executor.submit(run_instance, useg, logger, is_last, galaxy_instances))
 
-            except WFPathError as e:
-                logger.error(e)
-                logger.warning(f"Exiting with error: {ERR_CODES['path']}")
-                galaxy_instance.clean_up()
+        # Collect in submission order, so results follow the configuration order
+        for future in futures:
+            try:
+                name, instance_results, error = future.result()
+            except WFPathError:
+                stop_instances(executor, galaxy_instances)
                 sys.exit(ERR_CODES['path'])
-            except Exception as e:
-                exc = True
-                logger.warning(f"Error: {e}")
-                galaxy_instance.clean_up()
-                if not i == len(config['usegalaxy_instances'])-1:
-                    logger.warning("Skipping to the next instance")
-                continue
-            except ConnectionError as e:
+            if error == 'api':
                 conn_rr = True
-                logger.warning(f"Connection Error while testing {useg['name']}:")
-                logger.warning(f"{e}")
-                galaxy_instance.clean_up()
-                if not i == len(config['usegalaxy_instances'])-1:
-                    logger.warning("Skipping to the next instance")
-                continue
-
-            for pe in useg['endpoints']:
-                try:
-                    galaxy_instance.switch_pulsar(pe)
-                    compute_id = pe if pe != 'None' else 'Default'
-
-                    if useg['name'] not in results:
-                        results[useg['name']] = {}
-
-                    if compute_id not in results[useg['name']]:
-                        results[useg['name']][compute_id] = {
-                            "SUCCESSFUL_JOBS": {}, 
-                            "RUNNING_JOBS": {},
-                            "QUEUED_JOBS": {},
-                            "NEW_JOBS": {},
-                            "WAITING_JOBS": {},
-                            "FAILED_JOBS": {}
-                        }
-
-                    pre_results = galaxy_instance.execute_and_monitor_workflow(
-                        workflow_input = input
-                        )
-                    for key in ["SUCCESSFUL_JOBS", "RUNNING_JOBS", "FAILED_JOBS", "WAITING_JOBS", "QUEUED_JOBS", "NEW_JOBS"]:
-                        if key in pre_results and isinstance(pre_results[key], dict):
-                            results[useg['name']][compute_id][key].update(pre_results[key])
-
-                except Exception as e:
-                    logger.warning(f"An error occurred while testing {pe}:")
-                    logger.warning(f"{e}")
-                    logger.warning("Continuing...")
-
-                except ConnectionError as e:
-                    logger.warning(f"A Connection error occurred while testing {pe}:")
-                    logger.warning(f"{e}")
-                    logger.warning("Continuing...")
-                    
-            try:    
-                galaxy_instance.clean_up()
-                galaxy_instance.switch_pulsar(useg['default_compute_id'])
-
-            except Exception as e:
-                logger.warning(f"An error occurred while cleaning up:")
-                logger.warning(f"{e}")
-                logger.warning("Continuing...")
-
-            except ConnectionError as e:
-                logger.warning(f"An error occurred while cleaning up:")
-                logger.warning(f"{e}")
-                logger.warning("Continuing...")
+            elif error == 'gal':
+                exc = True
+            if instance_results:
+                results[name].update(instance_results)
+        executor.shutdown()
+        results = dict(results)
 
         try:
+            outputs = {}
             if args.html_report:
-                from src.html_output import Report
-                report = Report(args.html_report, results, config, class_logger=logger)
-                report.output_page()
-
+                outputs['html'] = args.html_report
             if args.md_report:
-                from src.html_output import Report
-                report = Report(args.md_report, results, config, class_logger=logger)
-                report.output_md()
-
-
+                outputs['md'] = args.md_report
             if args.table_html_report:
+                outputs['table'] = args.table_html_report
+
+            if outputs:
                 from src.html_output import Report
-                summary = Report(args.table_html_report, results, config, class_logger=logger)
-                summary.output_summary(True)
+                report = Report(None, results, config, class_logger=logger)
+                report.render_all(outputs)
 
         except Exception:
             logger.warning("The reports might not have been generated.")
 
-        print(json.dumps(results, indent=2, sort_keys=False)) #Work In Progress
+        if args.print_json:
+            print_json(results)
 
         logger.info("Test completed")
 
+        tto_code = ERR_CODES['tto']
+        job_code = ERR_CODES['job']
+        exit_on_jobs = not conn_rr or not exc
         for g_name, g_data in results.items():
             for com_id, job_data in g_data.items():
-                for k in ["RUNNING_JOBS","WAITING_JOBS", "QUEUED_JOBS", "NEW_JOBS"]:
-                    if job_data.get(k):
-                        logger.warning(f"Uncompleted jobs found in {g_name}/{com_id}.")
-                        logger.warning(f"Exiting with code: {ERR_CODES['tto']}")
-                        if not conn_rr or not exc:
-                            sys.exit(ERR_CODES['tto'])
+                if any(job_data.get(k) for k in _UNCOMPLETED_KEYS):
+                    logger.warning(f"Uncompleted jobs found in {g_name}/{com_id}.")
+                    logger.warning(f"Exiting with code: {tto_code}")
+                    if exit_on_jobs:
+                        sys.exit(tto_code)
                 if job_data.get("FAILED_JOBS"):
                     logger.warning(f"Failed jobs found in {g_name}/{com_id}.")
-                    logger.warning(f"Exiting with code: {ERR_CODES['job']}")
-                    if not conn_rr or not exc:
-                        sys.exit(ERR_CODES['job'])
+                    logger.warning(f"Exiting with code: {job_code}")
+                    if exit_on_jobs:
+                        sys.exit(job_code)
         if conn_rr:
             sys.exit(ERR_CODES['api'])
         if exc:
@@ -217,7 +329,7 @@ def main():
 
     except KeyboardInterrupt:
         logger.warning("Test interrupted")
-        galaxy_instance.clean_up()
+        stop_instances(executor, galaxy_instances)
         print("\n")
         sys.exit(0)
 
@@ -26,6 +26,7 @@ class Parser():
         self.parser.add_argument('-t', '--table_html_report', metavar='PATH', type=Path, nargs='?',
                             const= TABLE_DEFAULT, help='Enables HTML summary report, it accepts a path for the output:/path/report.html\
                                                             \nDefaults to \'~/saber_summary_YYYY-MM-DD_HH-MM-SS.html\' otherwise.')
+        self.parser.add_argument('-j', '--print_json', action='store_true', help='Prints the results of the test as JSON to stdout.')
         self.parser.add_argument('-l', '--log_dir', metavar='LOG DIRECTORY', type=Path,
                                  help='Custom log DIRECTORY. Defaults depends on the platform. \nMacOS: "/Users/<your-user>/Library/Logs/<tool-name>"\
                                     \n Windows: "C:\\Users\\<your-user>\\<tool-name>\\Local\\Acme\\<tool-name>\\Logs" \nLinux: "/home/<your-user>/.local/state/<tool-name>/log"' )
@@ -1,19 +1,83 @@
 #!/usr/bin/env python3
 
+import os
 import re
-import time
 import json
+import time
+import random
+import threading
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from platformdirs import user_cache_dir
 from src.globals import TOOL_NAME
 from datetime import datetime, timedelta
 from src.logger import CustomLogger
 from bioblend import ConnectionError
+from requests.exceptions import Timeout
 from bioblend.galaxy import datasets
 from bioblend.galaxy import GalaxyInstance
 from bioblend.galaxy.histories import HistoryClient
 
 
 
+@lru_cache(maxsize=32)
+def _load_workflow(wf_path: str, mtime_ns: int) -> dict:
+    '''
+    Parse a workflow file once per run, shared by all the instances.
+    The modification time is part of the key, so an edited file is read again.
+    '''
+    return json.loads(Path(wf_path).read_bytes())
+
+
+
+# How long the test workflow took on each instance and endpoint in previous runs
+_RUN_TIMES_FILE = Path(user_cache_dir(TOOL_NAME)) / 'run_times.json'
+_run_times_lock = threading.Lock()
+
+
+
+def _read_run_times() -> dict:
+    '''
+    Load the stored run times, an unreadable file is the same as no history.
+    '''
+    try:
+        return json.loads(_RUN_TIMES_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+
+def _save_run_time(key: str, seconds: float) -> None:
+    '''
+    Store a run time, the instances share the file so the update is serialized.
+    Nothing is stored without a writable cache directory.
+    '''
+    with _run_times_lock:
+        run_times = _read_run_times()
+        run_times[key] = seconds
+        tmp = _RUN_TIMES_FILE.with_name(f'.{_RUN_TIMES_FILE.name}.{os.getpid()}.tmp')
+        try:
+            _RUN_TIMES_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(run_times))
+            os.replace(tmp, _RUN_TIMES_FILE)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+
+
+# Digits and date/time separators, stripped from history names before comparing them
+_CLEAN_RE = re.compile(r'[0-9/:]+')
+
+# Dataset states that end an upload, and job states that end a job
+_TERMINAL_DATASET_STATES = frozenset({"ok", "empty", "error", "discarded", "failed_metadata"})
+_FINISHED_JOB_STATES = frozenset({"ok", "error"})
+
+# Results bucket of the jobs still pending at the timeout, by job state
+_PENDING_BUCKETS = {"new": "NEW_JOBS", "queued": "QUEUED_JOBS", "running": "RUNNING_JOBS", "waiting": "WAITING_JOBS"}
+
+
+
 class GalaxyTest():
     '''
     Creates a GalaxyInstance using bioblend, and logs operations with a custom logger.
@@ -49,17 +113,34 @@ class GalaxyTest():
             "sleep_time": 5,
             "maxwait": 12000,
             "interval": 5,
+            "poll_max": 30,
+            "poll_mult": 1.5,
+            "request_timeout": 120,
+            "get_attempts": 2,
+            "get_retry_delay": 2,
             "timeout": 12000,
             "history_name": "SABER",
             "clean_history": "onsuccess"
         }
         # Merge user-defined config with defaults
         self.config = {**default_config, **(config or {})}
+        # bioblend waits forever on an unresponsive server otherwise
+        self.gi.timeout = self.config['request_timeout']
+        # Ride out short network hiccups on reads instead of failing the whole test
+        self.gi.max_get_attempts = self.config['get_attempts']
+        self.gi.get_retry_delay = self.config['get_retry_delay']
         self.current_date = datetime.now().strftime('%-d/%-m/%y %H:%M')
         self.config['history_name'] = f"{self.config.get('history_name', 'SABER')} {self.current_date}"
         self.history_client = HistoryClient(self.gi)
         self.history = None
         self.wf = None
+        self._interrupted = threading.Event()
+        self.active_invocations = set()
+        self._invoked_at = {}  # Start time of each invocation, its timeout covers scheduling too
+        self._user_id = None
+        self._extra_prefs = None  # Parsed extra user preferences, as last written
+        self._bulk_supported = True  # False once the bulk history API failed on this instance
+        self._last_run_time = None  # Seconds the last completed invocation took
 
 
 
@@ -90,16 +171,23 @@ class GalaxyTest():
         if local: self.switch_pulsar(self.config['default_compute_id'], self.config['name'])
         self._create_history()
         self._upload_workflow()
-        inputs_dict = inputs_data
-        data = dict()
+        data = {}
         self.logger.info(f"Uploading and building Datasets")
-        for file_name, file_options in inputs_dict.items():
-            file_url = file_options['url']
-            file_type = file_options['file_type']
-            upload = self.gi.tools.put_url(file_url, history_id=self.history['id'], file_name=file_name, file_type=file_type)
-            upload_id = upload['outputs'][0]['id']
-            wf_input = self.gi.workflows.get_workflow_inputs(self.wf['id'], label=file_name)[0]
-            data[wf_input] = {'id':upload_id, 'src':'hda'}
+        # Workflow input IDs by label, the first one wins as with get_workflow_inputs
+        wf_inputs = {}
+        for input_id, wf_input in self.gi.workflows.show_workflow(self.wf['id'])['inputs'].items():
+            wf_inputs.setdefault(wf_input['label'], input_id)
+
+        def upload(item):
+            file_name, file_options = item
+            return self.gi.tools.put_url(file_options['url'], history_id=self.history['id'],
+                                         file_name=file_name, file_type=file_options['file_type'])
+
+        # Each upload request only queues a fetch on Galaxy, send them all at once
+        with ThreadPoolExecutor(max_workers=max(1, min(len(inputs_data), 8))) as executor:
+            uploads = list(executor.map(upload, inputs_data.items()))
+        for file_name, response in zip(inputs_data, uploads):
+            data[wf_inputs[file_name]] = {'id': response['outputs'][0]['id'], 'src':'hda'}
 
         # Wait for dataset
         self.logger.info("Waiting for datasets...")
@@ -115,27 +203,38 @@ class GalaxyTest():
         '''
         maxtime = self.config['maxwait'] if maxtime is None else maxtime
         dataset_client =  datasets.DatasetClient(self.gi)
-        all_datasets = dataset_client.get_datasets(history_id=self.history['id'])
+        states = {}
+        pending = None  # IDs of the datasets not in a terminal state yet, in history order
         
         def check_dataset_ready():
-            for dataset in all_datasets:
-                dataset_id = dataset['id']
-
-                dataset_info = dataset_client.show_dataset(dataset_id)
-                state = dataset_info['state']
+            nonlocal pending
+            # One listing per check returns the states of all the datasets of the history
+            listed = {d['id']: d.get('state') for d in dataset_client.get_datasets(history_id=self.history['id'])}
+            if pending is None:
+                # The datasets to wait for are the ones in the history at the first check
+                pending = dict.fromkeys(listed)
+            for dataset_id in list(pending):
+                state = listed.get(dataset_id)
+                if state is None:
+                    state = dataset_client.show_dataset(dataset_id)['state']
+                states[dataset_id] = state
                 
-                if state in {"ok", "empty", "error", "discarded", "failed_metadata"}:
+                if state in _TERMINAL_DATASET_STATES:
                     if state != "ok":
                         self.logger.warning(f"Dataset {dataset_id} is in terminal state {state}")
                         self.logger.error(f"Upload of Dataset {dataset_id} failed")
                         return True
-                    if state in {"ok", "empty"}:
-                        continue
+                    # Done, not checked again
+                    del pending[dataset_id]
+                    continue
                 self.logger.info(f"Dataset {dataset_id} is in non-terminal state {state}")
 
                 return False
             return True
-        return self._wait_for_state(check_dataset_ready, maxtime, interval, "Upload time exceeded")
+        def dataset_states():
+            return tuple(states.items())
+
+        return self._wait_for_state(check_dataset_ready, maxtime, interval, "Upload time exceeded", progress=dataset_states)
                      
 
 
@@ -169,9 +268,7 @@ class GalaxyTest():
 
     @staticmethod
     def _clean_string(s: str) -> str:
-        s = re.sub(r'[0-9/:]', '', s)
-        s = s.lower()
-        return s.strip()
+        return _CLEAN_RE.sub('', s).lower().strip()
 
 
     def purge_histories(self, purge_new: bool = True, purge_old: bool = True) -> None:
@@ -185,25 +282,25 @@ class GalaxyTest():
         :param purge_old: Defaults True - purges ALL histories older than one week.
         '''
         if self.history_client is not None:
-            for history in self.history_client.get_histories():
+            # Computed once per purge rather than once per history
+            cutoff = datetime.today() - timedelta(hours=36)
+            config_clean = self._clean_string(self.config.get('history_name'))
+            to_purge = []
+            # The creation time comes with the list, instead of one request per history
+            for history in self.history_client.get_histories(keys=['id', 'name', 'create_time']):
                 if self.config.get('history_name') == history['name'] and purge_new:
                     self.logger.info(f'Purging History, ID: {history["id"]}, Name: {history["name"]}')
-                    self._safe_delete_history(history['id'], purge_bool=True)
-                create_time = self.history_client.show_history(history_id=history['id'], keys=['create_time'])
-                if (datetime.today() - datetime.strptime(create_time['create_time'],
-                                                        "%Y-%m-%dT%H:%M:%S.%f")) > timedelta(hours=36) and purge_old:
-                    config_clean = self._clean_string(self.config.get('history_name'))
-                    history_clean = self._clean_string(history.get('name'))
-                    if config_clean in history_clean:
+                    to_purge.append(history['id'])
+                    continue
+                if purge_old and datetime.fromisoformat(history['create_time']) < cutoff:
+                    # A name containing the configured one also covers a matching word of it
+                    if config_clean in self._clean_string(history.get('name')):
                         self.logger.info(f'Purging History, ID: {history["id"]}, Name: {history["name"]}')
-                        self._safe_delete_history(history['id'], purge_bool=True)
-                        return   
-                    history_words = history_clean.split()
-                    for word in history_words:
-                        if config_clean == word:
-                            self.logger.info(f'Purging History, ID: {history["id"]}, Name: {history["name"]}')
-                            self._safe_delete_history(history['id'], purge_bool=True)
-                            return                           
+                        to_purge.append(history['id'])
+            if to_purge:
+                # The deletions are independent, send them concurrently
+                with ThreadPoolExecutor(max_workers=min(len(to_purge), 8)) as executor:
+                    list(executor.map(lambda history_id: self._safe_delete_history(history_id, purge_bool=True), to_purge))
 
 
     '''
@@ -250,27 +347,17 @@ class GalaxyTest():
         wf_path = Path(wf_path).expanduser()
 
         if not wf_path.is_absolute():
+            # Relative to the config file first, then falls back to CWD
             config_path = self.config.get('config_path', None)
-            if config_path:
-                c_wf_path = Path(config_path).parent / wf_path
-                c_wf_path = c_wf_path.resolve()
-                if c_wf_path.exists():
-                    wf_path = c_wf_path
-                else:
-                    wd_wf_path = Path.cwd() / wf_path  # Fall back to CWD
-                    wd_wf_path = wd_wf_path.resolve()
-                    if wd_wf_path.exists():
-                        wf_path = wd_wf_path
-            else:
-                wd_path = Path.cwd() / wf_path  # Fall back to CWD
-                wd_path = wd_path.resolve()
-                if wd_path.exists():
-                    wf_path = wd_path
+            bases = ([Path(config_path).parent] if config_path else []) + [Path.cwd()]
+            candidates = ((base / wf_path).resolve() for base in bases)
+            wf_path = next((c for c in candidates if c.exists()), wf_path)
 
 
         if wf_path.exists():
             self.logger.info(f'Uploading Workflow, local path: {wf_path}')
-            self.wf = self.gi.workflows.import_workflow_from_local_path(str(wf_path))
+            wf_dict = _load_workflow(str(wf_path), wf_path.stat().st_mtime_ns)
+            self.wf = self.gi.workflows.import_workflow_dict(wf_dict)
         else:
             error_msg = f"Workflow path does not exist: {wf_path}"
             raise WFPathError(error_msg)
@@ -284,29 +371,43 @@ class GalaxyTest():
         if self.wf is not None:
             self.gi.workflows.delete_workflow(self.wf['id'])
             self.logger.info(f'Purging Workflow, ID: {self.wf["id"]}')
+            self.wf = None
 
 
     @staticmethod
+    def canonical_endpoint(p_endpoint: str) -> str:
+        '''
+        Name under which an endpoint is logged, tagged and reported:
+        the default compute, "None" in the preferences, is shown as "Default".
+        '''
+        return "Default" if p_endpoint in (None, "None") else p_endpoint
+
+
+
+    @staticmethod
+    @lru_cache(maxsize=256)
     def _tool_id_split(tool_id: str) -> str:
         '''
         Remove all characters before "/devteam" inclusively, to avoid clutter in the log.
-        If the string is not present it leaves the input untouched
+        If the string is not present it leaves the input untouched.
+        Cached, since the same few tool IDs are logged on every poll.
         '''
-        if "/devteam/" in tool_id:
-            return tool_id.split("/devteam/")[1]
-        else:
-            return tool_id
+        return tool_id.partition("/devteam/")[2] or tool_id
 
 
 
-    def _monitor_job_status(self, invocation_id: str, 
+    def _monitor_job_status(self, invocation_id: str, p_endpoint: str,
                         timeout: int = None, sleep_time: int = None) -> dict:
         '''
         Monitor the status of a job invocation.
 
         :param invocation_id: The ID of the workflow invocation to monitor.
         :type invocation_id: str
-        :param timeout: Maximum time (in seconds) to wait for job completion. Defaults to 12000s.
+        :param p_endpoint: The Pulsar endpoint the invocation was submitted to, the current
+                           one may already belong to the next endpoint under test.
+        :type p_endpoint: str
+        :param timeout: Maximum time (in seconds) to wait for job completion, counted from the
+                        invocation. Defaults to 12000s.
         :type timeout: int, optional
         :param sleep_time: Time (in seconds) to wait between status checks. Defaults to 5s.
         :type sleep_time: int, optional
@@ -316,22 +417,30 @@ class GalaxyTest():
         sleep_time = self.config["sleep_time"] if sleep_time is None else sleep_time
         timeout = self.config["timeout"] if timeout is None else timeout
 
+        last_jobs = []
+
+        def _snapshot(jobs):
+            return tuple((job['id'], job['state']) for job in jobs)
+
         def job_completed():
-            # Get job status
+            # Get job status, all jobs of the invocation in a single request
             jobs = self.gi.jobs.get_jobs(invocation_id=invocation_id)
+            # Only log the states again when something moved since the last tick
+            changed = _snapshot(jobs) != _snapshot(last_jobs)
+            last_jobs[:] = jobs
             if not jobs:
                 return False
             
             all_jobs_completed = True
-            for i in range(len(jobs)):
-                current_job = jobs[i]
+            for current_job in jobs:
                 job_state = current_job['state']
                 #job_exit_code = current_job.get('exit_code')
-                tool_id = self._tool_id_split(current_job.get("tool_id"))
-                self.logger.info(f'    {job_state}    Tool ID: {tool_id}')
+                if changed:
+                    tool_id = self._tool_id_split(current_job.get("tool_id"))
+                    self.logger.info(f'    {job_state}    Tool ID: {tool_id}')
 
                 # Continue monitoring
-                if job_state not in ["ok", "error"]:
+                if job_state not in _FINISHED_JOB_STATES:
                     all_jobs_completed = False
 
                 #if job_state == "error":
@@ -339,89 +448,115 @@ class GalaxyTest():
                          
             return all_jobs_completed
         
-        self._wait_for_state(job_completed, timeout, sleep_time, f"Timeout {timeout}s expired.")
-
-        return self.gi.jobs.get_jobs(invocation_id=invocation_id)
-
-
-
-    def _handle_job_completion(self, jobs: list[dict[str, any]]) -> dict[dict[dict[list[dict[str, any]]]]]:
+        def job_states():
+            return _snapshot(last_jobs)
+
+        # The previous run on this endpoint, or the last endpoint of this instance to complete
+        run_key = f"{self.gi.base_url} {self.canonical_endpoint(p_endpoint)}"
+        expected = _read_run_times().get(run_key, self._last_run_time)
+        # Times count from the invocation, scheduling already used part of them
+        start_time = self._invoked_at.get(invocation_id, time.monotonic())
+        elapsed = time.monotonic() - start_time
+        if expected is not None:
+            expected -= elapsed
+        if self._wait_for_state(job_completed, timeout - elapsed, sleep_time, f"Timeout {timeout}s expired.",
+                                progress=job_states, expected=expected):
+            # Every endpoint runs the same workflow, the next one is likely to take as long
+            self._last_run_time = time.monotonic() - start_time
+            _save_run_time(run_key, self._last_run_time)
+            # The last check already fetched the final states
+            return last_jobs
+
+        return self._retry_on_timeout(self.gi.jobs.get_jobs, invocation_id=invocation_id)
+
+
+
+    def _handle_job_completion(self, jobs: list[dict[str, any]], p_endpoint: str = None) -> dict[dict[dict[list[dict[str, any]]]]]:
         '''
         Job completion handler. Changes History name in case of failures.
 
         :type job: dict
         :param job: Dict containing the job informations
+        :type p_endpoint: str
+        :param p_endpoint: Endpoint used to tag the outputs, defaults to the current one
         :return: Integer to indicate failure or success
         :rtype: int
         '''
-        running_jobs = {}
-        queued_jobs = {}
-        new_jobs = {}
-        waiting_jobs = {}
-        successful_jobs = {}
-        failed_jobs = {}
+        return_values = {"SUCCESSFUL_JOBS": {}, 
+                                     "RUNNING_JOBS": {},
+                                     "QUEUED_JOBS": {},
+                                     "NEW_JOBS": {},
+                                     "WAITING_JOBS": {}, 
+                                     "FAILED_JOBS": {}}
+        jobs = [job for job in jobs if job]
+        all_details = {}
+        if jobs:
+            # The details are independent requests, fetch them for all the jobs at once
+            with ThreadPoolExecutor(max_workers=min(len(jobs), 8)) as executor:
+                futures = {job['id']: executor.submit(self._job_details, job['id'], problems=not self._job_succeeded(job))
+                           for job in jobs}
+            all_details = {job_id: future.result() for job_id, future in futures.items()}
         for job in jobs:
-            if job:
-                if job['state'] in ['new', 'queued', 'running', 'waiting']:
-                    self.logger.info(f'Job {job["id"]} reached {TOOL_NAME} timeout:')
-                    self.logger.info(f'         Tool: {self._tool_id_split(job["tool_id"])} Status: {job["state"]}')
-                    self._add_tag(job["id"], msg_list=f"saber_{job['state']}")
-                    self.err_tracker = True
-                    if job['state'] == 'running':
-                        running_jobs[job['id']] = {"INFO":self.gi.jobs.show_job(job['id']),
-                                                    "PROBLEMS": self.gi.jobs.get_common_problems(job['id']),
-                                                    "METRICS": self.gi.jobs.get_metrics(job['id'])
-                                                    }
-                    if job['state'] == 'new':
-                        new_jobs[job['id']] = {"INFO":self.gi.jobs.show_job(job['id']),
-                                                    "PROBLEMS": self.gi.jobs.get_common_problems(job['id']),
-                                                    "METRICS": self.gi.jobs.get_metrics(job['id'])
-                                                    }
-                    if job['state'] == 'queued':
-                        queued_jobs[job['id']] = {"INFO":self.gi.jobs.show_job(job['id']),
-                                                    "PROBLEMS": self.gi.jobs.get_common_problems(job['id']),
-                                                    "METRICS": self.gi.jobs.get_metrics(job['id'])
-                                                    }
-                    if job['state'] == 'waiting':
-                        waiting_jobs[job['id']] = {"INFO":self.gi.jobs.show_job(job['id']),
-                                                    "PROBLEMS": self.gi.jobs.get_common_problems(job['id']),
-                                                    "METRICS": self.gi.jobs.get_metrics(job['id'])
-                                                    }
-                        
-                # Handle completion
-                elif job['exit_code'] == 0 or job['state'] == 'ok':
-                    self.logger.info(f'Job {job["id"]} succeeded:')
-                    self.logger.info(f'         Tool: {self._tool_id_split(job["tool_id"])}')
-                    successful_jobs[job['id']] = {"INFO": self.gi.jobs.show_job(job['id']),
-                                                "METRICS": self.gi.jobs.get_metrics(job['id'])
-                                                }
-                    if self.config.get('clean_history', "onsuccess") == "successful_only":
-                        self._delete_job_out(job["id"])
-                    else: 
-                        self._add_tag(job["id"])
-
-                else:
+            details = all_details[job['id']]
+            if job['state'] in _PENDING_BUCKETS:
+                self.logger.info(f'Job {job["id"]} reached {TOOL_NAME} timeout:')
+                self.logger.info(f'         Tool: {self._tool_id_split(job["tool_id"])} Status: {job["state"]}')
+                self._add_tag(job["id"], msg_list=f"saber_{job['state']}", p_endpoint=p_endpoint, job_info=details["INFO"])
+                self.err_tracker = True
+                return_values[_PENDING_BUCKETS[job['state']]][job['id']] = details
                     
-                    # Handle failure
-                    job_exit_code = job['exit_code'] if job and job['exit_code'] is not None else 'None'
-                    self.logger.info(f'Job {job["id"]} failed (exit_code: {job_exit_code}):')
-                    self.logger.info(f'         Tool: {self._tool_id_split(job["tool_id"])}')
-                    failed_jobs[job['id']] = {"INFO":self.gi.jobs.show_job(job['id']),
-                                    "PROBLEMS": self.gi.jobs.get_common_problems(job['id']),
-                                    "METRICS": self.gi.jobs.get_metrics(job['id'])}
-                    self._add_tag(job["id"], msg_list="err")
-                    self.err_tracker = True
-
-        return_values = {"SUCCESSFUL_JOBS": successful_jobs, 
-                                     "RUNNING_JOBS": running_jobs,
-                                     "QUEUED_JOBS": queued_jobs,
-                                     "NEW_JOBS": new_jobs,
-                                     "WAITING_JOBS": waiting_jobs, 
-                                     "FAILED_JOBS": failed_jobs}
+            # Handle completion
+            elif self._job_succeeded(job):
+                self.logger.info(f'Job {job["id"]} succeeded:')
+                self.logger.info(f'         Tool: {self._tool_id_split(job["tool_id"])}')
+                return_values["SUCCESSFUL_JOBS"][job['id']] = details
+                if self.config.get('clean_history', "onsuccess") == "successful_only":
+                    self._delete_job_out(job["id"], job_info=details["INFO"])
+                else: 
+                    self._add_tag(job["id"], p_endpoint=p_endpoint, job_info=details["INFO"])
+
+            else:
+                
+                # Handle failure
+                job_exit_code = job['exit_code'] if job and job['exit_code'] is not None else 'None'
+                self.logger.info(f'Job {job["id"]} failed (exit_code: {job_exit_code}):')
+                self.logger.info(f'         Tool: {self._tool_id_split(job["tool_id"])}')
+                return_values["FAILED_JOBS"][job['id']] = details
+                self._add_tag(job["id"], msg_list="err", p_endpoint=p_endpoint, job_info=details["INFO"])
+                self.err_tracker = True
+
         return return_values
 
 
 
+    @staticmethod
+    def _job_succeeded(job: dict) -> bool:
+        '''
+        Whether a job, as listed by get_jobs, finished successfully.
+        '''
+        return job['state'] not in _PENDING_BUCKETS and (job['exit_code'] == 0 or job['state'] == 'ok')
+
+
+
+    def _job_details(self, job_id: str, problems: bool = True) -> dict:
+        '''
+        Collect the details of a job for the reports.
+
+        :param job_id: The ID of the job.
+        :type job_id: str
+        :param problems: Whether to include the common problems of the job.
+        :type problems: bool
+        :return: The job information, its metrics and, if requested, its common problems.
+        :rtype: dict
+        '''
+        details = {"INFO": self._retry_on_timeout(self.gi.jobs.show_job, job_id)}
+        if problems:
+            details["PROBLEMS"] = self._retry_on_timeout(self.gi.jobs.get_common_problems, job_id)
+        details["METRICS"] = self._retry_on_timeout(self.gi.jobs.get_metrics, job_id)
+        return details
+
+
+
     def execute_and_monitor_workflow(self, workflow_input: dict, timeout: int = None) -> dict[list[dict[str, any]]]:
         '''
         Executes a workflow and monitors its status until completion or timeout.
@@ -433,23 +568,95 @@ class GalaxyTest():
         :return: The exit code or status of the executed workflow.
         :rtype: int
         '''
-        timeout = self.config["timeout"] if timeout is None else timeout       
-        # Workflow invocation
+        invocation_id = self.invoke_workflow(workflow_input)
+        return self.monitor_invocation(invocation_id, self.p_endpoint, timeout)
+
+
+
+    def invoke_workflow(self, workflow_input: dict) -> str:
+        '''
+        Invokes the test workflow on the current Pulsar endpoint.
+
+        :param workflow_input: A dictionary containing the input parameters for the workflow.
+        :type workflow_input: dict
+        :return: The ID of the workflow invocation.
+        :rtype: str
+        '''
         invocation = self.gi.workflows.invoke_workflow(
             self.wf['id'],
             inputs=workflow_input,
             history_id= self.history['id']
         )
         self.logger.info( f'Invocation id: {invocation["id"]}')
-        
+        self.active_invocations.add(invocation['id'])
+        self._invoked_at[invocation['id']] = time.monotonic()
+        return invocation['id']
+
+
+
+    def wait_for_scheduling(self, invocation_id: str, timeout: int = None, sleep_time: int = None) -> bool:
+        '''
+        Waits until every step of the invocation is scheduled and no job is left in the
+        "new" state. The Pulsar endpoint is read from the user preferences when a job
+        leaves "new", so switching endpoint before this point could reroute the jobs.
+
+        :param invocation_id: The ID of the workflow invocation.
+        :type invocation_id: str
+        :param timeout: Maximum time (in seconds) for the whole invocation, counted from its start.
+                        Defaults to the config timeout.
+        :type timeout: int, optional
+        :param sleep_time: Time (in seconds) to wait between checks. Defaults to the config sleep_time.
+        :type sleep_time: int, optional
+        :return: True if the jobs were scheduled before the timeout, otherwise False.
+        :rtype: bool
+        '''
+        sleep_time = self.config["sleep_time"] if sleep_time is None else sleep_time
+        timeout = self.config["timeout"] if timeout is None else timeout
+
+        def jobs_scheduled():
+            invocation = self.gi.invocations.show_invocation(invocation_id)
+            if invocation['state'] in ['failed', 'cancelled']:
+                return True
+            if invocation['state'] != 'scheduled':
+                return False
+            jobs = self.gi.jobs.get_jobs(invocation_id=invocation_id)
+            return all(job['state'] != 'new' for job in jobs)
+
+        elapsed = time.monotonic() - self._invoked_at.get(invocation_id, time.monotonic())
+        return self._wait_for_state(jobs_scheduled, timeout - elapsed, sleep_time,
+                                    f"Scheduling timeout {timeout}s expired.")
+
+
+
+    def monitor_invocation(self, invocation_id: str, p_endpoint: str, timeout: int = None) -> dict[list[dict[str, any]]]:
+        '''
+        Monitors an invocation until completion or timeout and sorts its jobs by state.
+        Does not rely on the current endpoint, so it can run in a separate thread
+        while other endpoints are tested.
+
+        :param invocation_id: The ID of the workflow invocation to monitor.
+        :type invocation_id: str
+        :param p_endpoint: The Pulsar endpoint the invocation was submitted to.
+        :type p_endpoint: str
+        :param timeout: Maximum time (in seconds) for the workflow to complete, counted from the
+                        invocation, so the scheduling wait is included. Defaults to 12000s.
+        :type timeout: int, optional
+        :return: Jobs of the invocation sorted by final state.
+        :rtype: dict
+        '''
+        timeout = self.config["timeout"] if timeout is None else timeout
+        self.logger.update_log_context(self.config['name'], self.canonical_endpoint(p_endpoint))
+
         # Monitor the job using the previous function!
         self.logger.info('Waiting until test job finishes. Current state:')
         final_job_status = self._monitor_job_status(
-             invocation['id'], timeout
+             invocation_id, p_endpoint, timeout
         )
+        self.active_invocations.discard(invocation_id)
+        self._invoked_at.pop(invocation_id, None)
         
         # Handle job completion
-        return self._handle_job_completion(final_job_status)
+        return self._handle_job_completion(final_job_status, p_endpoint)
 
 
 
@@ -463,50 +670,142 @@ class GalaxyTest():
         :type name: str, optional
         '''
         name = self.config['name'] if name is None else name
-        user_id = self.gi.users.get_current_user()['id']
-        prefs = self.gi.users.get_current_user().get('preferences', {}).get('extra_user_preferences', {})
-        new_prefs = json.loads(prefs).copy() # TODO: find a workaround to not use the json library only for this bit
-        new_prefs.update({'distributed_compute|remote_resources' : p_endpoint})
+        if self._extra_prefs is None:
+            # Read once: afterwards only this test changes the preferences
+            user = self.gi.users.get_current_user()
+            self._user_id = user['id']
+            self._extra_prefs = json.loads(user.get('preferences', {}).get('extra_user_preferences') or '{}')
+        prefs = self._extra_prefs
+        new_prefs = {**prefs, 'distributed_compute|remote_resources' : p_endpoint}
         self.p_endpoint = p_endpoint
 
         if prefs != new_prefs:
             self.logger.info('Updating pulsar endpoint in user preferences')
-            self.gi.users.update_user(user_id=user_id, user_data = new_prefs)
-            if p_endpoint == "None":
-                p_endpoint = "Default"
-            self.logger.update_log_context(name, p_endpoint)
-            self.logger.info(f"Switching to pulsar endpoint {p_endpoint} "
-                        f"from {name} instance")
+            self.gi.users.update_user(user_id=self._user_id, user_data = new_prefs)
+            self._extra_prefs = new_prefs
+        p_endpoint = self.canonical_endpoint(p_endpoint)
+        self.logger.update_log_context(name, p_endpoint)
+        self.logger.info(f"Switching to pulsar endpoint {p_endpoint} "
+                    f"from {name} instance")
 
 
 
-    def _wait_for_state(self, check_function, timeout: int, interval: int, error_msg: str):
+    def _wait_for_state(self, check_function, timeout: int, interval: int, error_msg: str,
+                        progress = None, max_interval: float = None, multiplier: float = None,
+                        expected: float = None):
         '''
         Waits for a specific state to be reached by periodically checking the provided function.
+        The delay between checks starts at `interval` and grows by `multiplier` up to `max_interval`
+        while nothing changes, it goes back to `interval` whenever `progress` returns a new value.
+        Each delay is randomly stretched by up to 10%.
+        When `expected` is given a check is placed at that time, so that a state reached
+        as quickly as last time is not missed by a long delay.
 
         :param check_function: A function that returns a boolean to indicate its state.
         :type check_function: callable
         :param timeout: The maximum time to wait for the state to be reached.
         :type timeout: int
-        :param interval: The time to wait between state checks.
+        :param interval: The initial, and minimum, time to wait between state checks.
         :type interval: int
         :param error_msg: The message to log if the timeout is exceeded.
         :type error_msg: str
+        :param progress: Optional function returning a snapshot of the observed state, called after each check.
+        :type progress: callable, optional
+        :param max_interval: Maximum time between checks. Defaults to the config poll_max.
+        :type max_interval: float, optional
+        :param multiplier: Growth factor of the time between checks. Defaults to the config poll_mult.
+        :type multiplier: float, optional
+        :param expected: Time, from the start, at which the state is expected to be reached.
+        :type expected: float, optional
         :return: True if the desired state was reached, otherwise False.
         :rtype: bool
         '''
-        start_time = datetime.now()
+        max_interval = max(interval, self.config["poll_max"] if max_interval is None else max_interval)
+        multiplier = self.config["poll_mult"] if multiplier is None else multiplier
+        current = interval
+        last_snapshot = None
+        start_time = time.monotonic()
         while True:
-            elapsed_time = (datetime.now() - start_time).total_seconds()
+            elapsed_time = time.monotonic() - start_time
             if elapsed_time + interval > timeout:
                 self.logger.error(error_msg)
                 return False
-            if check_function():
-                return True
-            time.sleep(interval)
+            try:
+                if check_function():
+                    return True
+            except Timeout as e:
+                # A slow answer is not a failure of the test, try again on the next check
+                self.logger.warning(f"State check timed out: {e}")
+            snapshot = progress() if progress is not None else None
+            if snapshot is not None and snapshot != last_snapshot:
+                # Something changed, look again soon
+                current = interval
+                last_snapshot = snapshot
+            else:
+                current = min(current * multiplier, max_interval)
+            # Up to 10% jitter, so that tests started together do not poll in lockstep,
+            # applied before the cap so the last wait does not run past the timeout
+            delay = min(current * random.uniform(1, 1.1), max(interval, timeout - elapsed_time - interval))
+            if expected is not None and elapsed_time < expected <= elapsed_time + delay:
+                # Land on the expected time, then check at the initial rate again
+                delay = max(interval, expected - elapsed_time)
+                current = interval
+            if self._interrupted.wait(delay):
+                raise KeyboardInterrupt
     
 
 
+    def interrupt(self) -> None:
+        '''
+        Stop any ongoing wait, used when the tests run in a worker thread.
+        The waiting thread raises KeyboardInterrupt on its next check.
+        '''
+        self._interrupted.set()
+
+
+
+    def cancel_invocations(self) -> None:
+        '''
+        Cancel the invocations still being monitored, along with their jobs,
+        so that an interrupted test does not leave jobs queued on the instance.
+        '''
+        for invocation_id in list(self.active_invocations):
+            self._cancel_invocation(invocation_id)
+
+
+
+    def _cancel_invocation(self, invocation_id: str) -> None:
+        '''
+        Cancel one invocation, a failure is only logged.
+        '''
+        try:
+            self.gi.invocations.cancel_invocation(invocation_id)
+            self.logger.info(f"Cancelled invocation, ID: {invocation_id}")
+        except Exception as e:
+            self.logger.warning(f"Could not cancel invocation {invocation_id}: {e}")
+        self.active_invocations.discard(invocation_id)
+        self._invoked_at.pop(invocation_id, None)
+
+
+
+    def abort_invocation(self, invocation_id: str, p_endpoint: str) -> dict[list[dict[str, any]]]:
+        '''
+        Cancel an invocation that will not be monitored, e.g. not scheduled in time,
+        and sort its jobs by their state at that point, as at a timeout.
+
+        :param invocation_id: The ID of the workflow invocation.
+        :type invocation_id: str
+        :param p_endpoint: The Pulsar endpoint the invocation was submitted to.
+        :type p_endpoint: str
+        :return: Jobs of the invocation sorted by state.
+        :rtype: dict
+        '''
+        jobs = self._retry_on_timeout(self.gi.jobs.get_jobs, invocation_id=invocation_id)
+        self._cancel_invocation(invocation_id)
+        return self._handle_job_completion(jobs, p_endpoint)
+
+
+
     def clean_up(self):
         """Clean up function"""
         clean_his = self.config.get('clean_history', "onsuccess")
@@ -520,34 +819,121 @@ class GalaxyTest():
 
 
 
-    def _add_tag(self, job_id: str, msg_list: list = None):
+    def _add_tag(self, job_id: str, msg_list: list = None, p_endpoint: str = None, job_info: dict = None):
         """Add tag to job"""
-        job_outputs = self.gi.jobs.get_outputs(job_id)
-        p_endpoint = self.p_endpoint
-        if p_endpoint == "None":
-            p_endpoint = "Default"
-        tag_list = [p_endpoint]
+        set_ids = self._output_ids(job_id, job_info)
+        if not set_ids:
+            return
+        p_endpoint = self.p_endpoint if p_endpoint is None else p_endpoint
+        tag_list = [self.canonical_endpoint(p_endpoint)]
         if msg_list and len(msg_list) > 0:
             tag_list.append(msg_list)
-        for output in job_outputs:
-            set_id = output['dataset']['id']
-            self.history_client.update_dataset(history_id=self.history['id'], dataset_id=set_id, tags=tag_list)
+        if not self._bulk_update(set_ids, "add_tags", {"tags": tag_list}):
+            for set_id in set_ids:
+                self.history_client.update_dataset(history_id=self.history['id'], dataset_id=set_id, tags=tag_list)
         self.logger.info(f"Added tags: {tag_list} to job {job_id} outputs.")
 
 
 
-    def _delete_job_out(self, job_id: str):
+    def _delete_job_out(self, job_id: str, job_info: dict = None):
         """Remove successful jobs' datasets"""
         if not self.gi.jobs.cancel_job(job_id):
-            job_outputs = self.gi.jobs.get_outputs(job_id)
-            for output in job_outputs:
-                set_id = output['dataset']['id']
-                self.history_client.update_dataset(history_id=self.history['id'], dataset_id=set_id, deleted=True)
-                self.history_client.delete_dataset(history_id=self.history['id'], dataset_id=set_id, purge=True)
+            set_ids = self._output_ids(job_id, job_info)
+            if not self._bulk_update(set_ids, "purge") and set_ids:
+                # The datasets are independent, purge them concurrently
+                with ThreadPoolExecutor(max_workers=min(len(set_ids), 8)) as executor:
+                    list(executor.map(self._purge_dataset, set_ids))
+            for set_id in set_ids:
                 self.logger.info(f"Purging dataset: {set_id}")
 
 
 
+    def _purge_dataset(self, set_id: str):
+        """Purge a dataset of the test history, Galaxy marks it as deleted too"""
+        self.history_client.delete_dataset(history_id=self.history['id'], dataset_id=set_id, purge=True)
+
+
+
+    def _output_ids(self, job_id: str, job_info: dict = None) -> list:
+        '''
+        IDs of the datasets produced by a job.
+
+        :param job_id: The ID of the job.
+        :type job_id: str
+        :param job_info: The job as returned by show_job, its outputs are used instead of a new request.
+        :type job_info: dict, optional
+        :return: The IDs of the output datasets.
+        :rtype: list
+        '''
+        if job_info is not None and 'outputs' in job_info:
+            return [output['id'] for output in job_info['outputs'].values()]
+        return [output['dataset']['id'] for output in self._retry_on_timeout(self.gi.jobs.get_outputs, job_id)]
+
+
+
+    def _retry_on_timeout(self, request, *args, **kwargs):
+        '''
+        Make a read request outside the polling loops, trying it again when it times out:
+        bioblend only retries failed connections and error statuses.
+        The last timeout is raised, after get_attempts tries in total.
+
+        :param request: The bioblend method to call.
+        :type request: callable
+        :return: What the request returns.
+        '''
+        for _ in range(self.config['get_attempts'] - 1):
+            try:
+                return request(*args, **kwargs)
+            except Timeout as e:
+                self.logger.warning(f"Request timed out, trying again: {e}")
+        return request(*args, **kwargs)
+
+
+
+    def _bulk_update(self, dataset_ids: list, operation: str, params: dict = None) -> bool:
+        '''
+        Apply an operation to several datasets of the test history in a single request.
+        Errors on single datasets are logged. Once the request itself fails, e.g. on
+        Galaxy releases without the bulk API, it is not tried again on this instance.
+
+        :param dataset_ids: IDs of the datasets to update.
+        :type dataset_ids: list
+        :param operation: Name of the bulk operation, e.g. "add_tags" or "purge".
+        :type operation: str
+        :param params: Parameters of the operation, if it needs any.
+        :type params: dict, optional
+        :return: False if the bulk request failed now or before,
+                 the caller should then update the datasets one by one.
+        :rtype: bool
+        '''
+        if not dataset_ids:
+            return True
+        if not self._bulk_supported:
+            return False
+        payload = {
+            "operation": operation,
+            "items": [{"id": set_id, "history_content_type": "dataset"} for set_id in dataset_ids],
+        }
+        if params is not None:
+            payload["params"] = {"type": operation, **params}
+        try:
+            response = self.gi.make_put_request(f"{self.gi.url}/histories/{self.history['id']}/contents/bulk", payload=payload)
+        except Timeout as e:
+            # The server is slow, not lacking the API: fall back for this job only
+            self.logger.warning(f"Bulk {operation} timed out, updating datasets one by one: {e}")
+            return False
+        except ConnectionError as e:
+            # Warn once, the following jobs go straight to the fallback
+            self._bulk_supported = False
+            self.logger.warning(f"Bulk {operation} failed, updating datasets one by one from now on: {e}")
+            return False
+        # The request succeeds as a whole even if some of the datasets could not be updated
+        for error in (response or {}).get('errors', []):
+            self.logger.warning(f"Bulk {operation} failed for dataset {(error.get('item') or {}).get('id')}: {error.get('error')}")
+        return True
+
+
+
 class WFPathError(Exception):
     """Custom exception for workflow path error cases."""
     pass
@@ -1,19 +1,22 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 from pathlib import Path
+from functools import lru_cache
 
 
 #Globals variables
 
 # Mock Functions
+@lru_cache(maxsize=1)
 def mock_get_default_config_path() -> str:
     if os.name == 'nt':  # Windows
         base_path = Path(os.environ.get('APPDATA', Path.home()))
         config_dir = base_path / TOOL_NAME
     elif os.name == 'posix':  # Linux/Unix/macOS
         base_path = Path.home()
-        if os.path.exists('/Library'):  # macOS
+        if sys.platform == 'darwin':  # macOS
             config_dir = base_path / 'Library' / 'Application Support' / f'{TOOL_NAME}.yaml'
         else:  # Linux/Unix
             config_dir = base_path / '.config' / f'{TOOL_NAME}.yaml'
@@ -56,6 +59,11 @@ usegalaxy_instances:
     maxwait: 12000  # Upload timeout in seconds
     interval: 5  # Time (seconds) between uploads state checks
     sleep_time: 5 # Time between jobs states checks
+    poll_max: 30  # Maximum time (seconds) between states checks while nothing changes
+    poll_mult: 1.5  # Growth factor of the time between states checks
+    request_timeout: 120  # Time (seconds) to wait for an answer to each API request
+    get_attempts: 2  # Times a failed API read is tried, any error status is retried
+    get_retry_delay: 2  # Time (seconds) between the attempts of a failed API read
 
 # Global settings (can be overridden per instance)
 ga_path: "/absolute/path"  # Define path to workflow .ga file
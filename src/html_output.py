@@ -1,9 +1,42 @@
 #!/usr/bin/env python3
 
-from jinja2 import Template, TemplateError
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, TemplateError
+from platformdirs import user_cache_dir
 from src.globals import TOOL_NAME
 from src.logger import os, CustomLogger
-from src. secure_config import tempfile, Path
+from src. secure_config import Path
+
+
+def _bytecode_cache(name: str):
+    '''
+    Keep the compiled templates in the user cache directory, to reuse them
+    across runs. Entries are keyed on the template source, so edits invalidate them,
+    but not on the Environment options: each Environment needs its own directory.
+    Without a writable cache directory the templates are compiled on each run.
+    '''
+    cache_dir = Path(user_cache_dir(TOOL_NAME)) / name
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(cache_dir, os.W_OK):
+        return None
+    return FileSystemBytecodeCache(str(cache_dir))
+
+
+# Job buckets of the results and their keys in the pie charts
+_JOB_TYPES = ("SUCCESSFUL_JOBS", "RUNNING_JOBS", "FAILED_JOBS", "WAITING_JOBS", "QUEUED_JOBS", "NEW_JOBS")
+_JOB_KEYS = tuple(k.split('_')[0].lower() for k in _JOB_TYPES)
+
+# Shared by every report: templates are loaded and compiled once, then cached
+_TEMPLATES_DIR = Path(__file__).parent / 'templates'
+_ENV = Environment(loader=FileSystemLoader(str(_TEMPLATES_DIR)), auto_reload=False,
+                   bytecode_cache=_bytecode_cache('templates'))
+# Block tags do not leave blank lines in the HTML, where the whitespace is not significant.
+# The Markdown tables depend on it, so that template stays on the default environment
+_HTML_ENV = _ENV.overlay(trim_blocks=True, lstrip_blocks=True,
+                         bytecode_cache=_bytecode_cache('templates-trimmed'))
+
 
 class Report:
     def __init__(self, path: Path, dict_results: dict, configuration: dict, class_logger = None):
@@ -11,139 +44,127 @@ class Report:
         self.path = path
         self.saber_results = dict_results
         self.config = configuration
+        self._urls = {i['name']: i['url'] for i in configuration['usegalaxy_instances']}
+        self._processed = None  # _process_data result, the results do not change
 
     def _write_file(self, content):
+        # content is either the rendered text or a template stream, written as it renders.
+        # Temporary file next to the report, so that the replace is a same-filesystem rename.
+        # No fsync: reports are not durability-critical
+        tmp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
         try:
-            with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp_file:
-                tmp_file.write(content)
-                tmp_file.flush()  # Ensure data is written
-                os.fsync(tmp_file.fileno())  # Force write to disk
-                tmp_path = Path(tmp_file.name)
-            
+            if isinstance(content, str):
+                tmp_path.write_text(content, encoding='utf-8')
+            else:
+                content.dump(str(tmp_path), encoding='utf-8')
             os.replace(tmp_path, self.path) # Either succed or fails to replace file 
             self.logger.info(f"Report generated successfully at {self.path}")
 
-        except OSError:
-            # Fallback: Use same-directory temporary file
-            temp_path = self.path.with_suffix('.tmp')
-            try:
-                # Write encrypted data to temporary file
-                with open(temp_path, 'w') as f:
-                    f.write(content)
-                    f.flush()
-                    os.fsync(f.fileno())
-                
-                os.rename(temp_path, self.path)  # Still atomic like replace
-                self.logger.info(f"Report generated successfully at {self.path}")
-            except Exception as e:
-                # Clean up
-                self.logger.warning(f"An error occured while writing the report: {e}")
-                if temp_path.exists():
-                    try:
-                        os.unlink(temp_path)
-                        self.logger.warning(f"Temporary file {temp_path} removed after failure")
-                    except Exception:
-                         self.logger.warning(f"Failed to remove temporary file {temp_path}")
-                raise e
+        except Exception as e:
+            # Clean up, a stream can also fail while rendering
+            self.logger.warning(f"An error occured while writing the report: {e}")
+            if tmp_path.exists():
+                try:
+                    os.unlink(tmp_path)
+                    self.logger.warning(f"Temporary file {tmp_path} removed after failure")
+                except Exception:
+                     self.logger.warning(f"Failed to remove temporary file {tmp_path}")
+            raise e
 
 
 
     def _process_data(self) -> dict:
+        if self._processed is not None:
+            return self._processed
         endpoint_counts = {}
         instances_counts = {}
-        urls = {}
         pies = {}
         compute_data = self.saber_results
         # Parse the data structure
         self.logger.info("Processing data...")
         for available_at, endpoints_data in compute_data.items():
+            instances_counts[available_at] = len(endpoints_data)  # Rows of the instance in the table
             for endpoint, jobs_data in endpoints_data.items():
-                job_types = ["SUCCESSFUL_JOBS", "RUNNING_JOBS", "FAILED_JOBS", "WAITING_JOBS", "QUEUED_JOBS", "NEW_JOBS"]
-
-                instances_counts.setdefault(available_at, 0)
-                instances_counts[available_at] += 1
-
-                if available_at not in pies:
-                    pies[available_at] = {}
-                if endpoint not in pies[available_at]:
-                    pies[available_at][endpoint] = {}
-                    pies[available_at][endpoint]['tot'] = 0
-                for k in job_types:
-                    pies[available_at][endpoint]['tot'] += len(jobs_data.get(k, {}))
-                if pies[available_at][endpoint]['tot'] > 0:
-                    pies[available_at][endpoint]['bb_errors'] = False
-                    for k in job_types:
-                        key = k.split('_')[0].lower()  
-                        pies[available_at][endpoint][key] = (len(jobs_data.get(k, {}))/pies[available_at][endpoint]['tot']) * 100
+                # Single pass: count each job type once, then derive total and percentages
+                counts = [len(jobs_data.get(k) or {}) for k in _JOB_TYPES]
+                total = sum(counts)
+
+                pie = {'tot': total}
+                if total > 0:
+                    pie['bb_errors'] = False
+                    for key, n in zip(_JOB_KEYS, counts):
+                        pie[key] = (n/total) * 100
+                    endpoint_counts[(endpoint, available_at)] = total
                 else:
-                    pies[available_at][endpoint]['bb_errors'] = True
-
-                for job_type in job_types:
-                    jobs = None
-                    if hasattr(jobs_data, job_type) and isinstance(getattr(jobs_data, job_type), dict):
-                        jobs = getattr(jobs_data, job_type)
-                    elif isinstance(jobs_data, dict) and job_type in jobs_data:
-                        jobs = jobs_data[job_type]
-                        
-                    if not jobs:
-                        continue
-                        
-                    for job_id in jobs:
-                        key = (endpoint, available_at)
-                        endpoint_counts.setdefault(key, 0)
-                        endpoint_counts[key] += 1
-
-
-        for i in self.config['usegalaxy_instances']:
-            urls[i['name']] = i['url']
-
-        return {
+                    pie['bb_errors'] = True
+                pies.setdefault(available_at, {})[endpoint] = pie
+
+        self._processed = {
             "compute_data": compute_data,
             "endpoint_counts": endpoint_counts,
             "instances_counts": instances_counts,
-            "urls": urls,
+            "urls": self._urls,
             "cherry": pies
         }
+        return self._processed
 
 
 
-    def output_page(self) -> None:
+    def render_all(self, outputs: dict) -> None:
+        '''
+        Render every requested report.
+
+        :param outputs: Mapping of report format ('html', 'md' or 'table') to output path.
+        :type outputs: dict
+        '''
+        for fmt, path in outputs.items():
+            self.path = path
+            if fmt == 'html':
+                self.output_page()
+            elif fmt == 'md':
+                self.output_md()
+            elif fmt == 'table':
+                self.output_summary(True)
+
+
+
+    def _render(self, template_name: str, stream: bool = False, **extra):
+        '''
+        Render a report template, with the processed results and the test date as context.
+
+        :param template_name: Name of the template file in the templates directory.
+        :type template_name: str
+        :param stream: Return a template stream, written while rendering, instead of a string.
+        :type stream: bool
+        :return: The rendered template, or its stream.
+        :rtype: str or jinja2.environment.TemplateStream
+        '''
+        env = _HTML_ENV if template_name.endswith('.html.j2') else _ENV
+        template = env.get_template(template_name)
+        context = {**self._process_data(), "data": self.saber_results, "date": self.config["date"], **extra}
+        return template.stream(context) if stream else template.render(context)
 
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        template_path = os.path.join(script_dir, 'templates', 'galaxy_template.html.j2')
 
-        with open(template_path, 'r') as f:
-            template_str = f.read()
 
-        template = Template(template_str)
+    def output_page(self) -> None:
 
         # Render 
         try:
             rendered_html = self.output_summary(standalone=False)
-            page_rendered_html = template.render(data=self.saber_results, rendered_html=rendered_html)
+            self._write_file(self._render('galaxy_template.html.j2', stream=True, rendered_html=rendered_html))
         except TemplateError as e:
             self.logger.error(f"Template rendering error: {str(e)}")
             raise
         
         self.logger.info("HTML page rendering completed.")
-        self._write_file(page_rendered_html)
 
 
 
     def output_summary(self, standalone: bool):
 
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        table_path = os.path.join(script_dir, 'templates', 'table_summary.html.j2')
-
-        with open(table_path, 'r') as f:
-            template_table_str = f.read()
-
-        table_template = Template(template_table_str)
-        template_context = self._process_data()
-
         # Render
         try:
-            rendered_html = table_template.render(**template_context, standalone=standalone, date=self.config["date"])
+            rendered_html = self._render('table_summary.html.j2', standalone=standalone)
         except TemplateError as e:
             self.logger.error(f"Template rendering error: {str(e)}")
             raise
@@ -157,21 +178,10 @@ class Report:
         
     def output_md(self) -> None:
 
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        template_path = os.path.join(script_dir, 'templates', 'galaxy_report.md.j2')
-
-        with open(template_path, 'r') as f:
-            template_str = f.read()
-
-        template = Template(template_str)
-        template_context = self._process_data()
-
         # Render 
         try:
-            page_rendered_md = template.render(**template_context, data=self.saber_results,  date=self.config["date"])
+            self._write_file(self._render('galaxy_report.md.j2', stream=True))
         except TemplateError as e:
             self.logger.error(f"Template rendering error: {str(e)}")
             raise
-        self.logger.info("Markdown file rendering completed.")
-
-        self._write_file(page_rendered_md)
\ No newline at end of file
+        self.logger.info("Markdown file rendering completed.")
\ No newline at end of file
@@ -3,6 +3,7 @@
 import os
 import logging
 import platform
+import threading
 from pathlib import Path
 from platformdirs import user_log_dir
 
@@ -24,6 +25,20 @@ class ContextFilter(logging.Filter):
         record.pulsar = self.context.get('Endpoint', 'Default')
         return True
 
+class ThreadContext(threading.local):
+    """
+    Logging context kept per thread, so that instances tested concurrently
+    do not overwrite each other's labels.
+    """
+    def __init__(self, **defaults):
+        self.__dict__.update(defaults)
+
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.__dict__[key] = value
+
 class SafeFormatter(logging.Formatter):
     """A formatter that doesn't fail when log records are missing expected attributes"""
     
@@ -49,10 +64,10 @@ class CustomLogger():
         :type init_log_name: str
         :param init_log_name: logger's name.
         '''
-        self._log_context = {
-            "GalaxyInstance": "None",
-            "Endpoint": "None"
-        }
+        self._log_context = ThreadContext(
+            GalaxyInstance="None",
+            Endpoint="None"
+        )
         self._log_name = init_log_name
 
         # Initialize actual logger
@@ -13,6 +13,11 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+try:
+    from yaml import CSafeLoader as _SafeLoader  # libyaml C binding
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
 
 class SecureConfig:
     '''
@@ -238,15 +243,15 @@ class SecureConfig:
         if not self.is_encrypted():
             
             # Read and validate the existing YAML file
-            with open(self.config_path, 'rb') as f:
-                yaml_data = f.read()
+            yaml_data = self.config_path.read_bytes()
     
             if yaml_data and not yaml_data.endswith(b"\n"):
                 yaml_data += b"\n"
             
-            # Validate YAML format before encryption
+            # Validate YAML format before encryption, with the same loader as load_config,
+            # so tags it cannot construct are rejected now and not at the next run
             try:
-                yaml.safe_load(yaml_data)
+                yaml.load(yaml_data, Loader=_SafeLoader)
             except yaml.YAMLError:
                 raise ValueError("Invalid YAML data in configuration file")
                     
@@ -271,13 +276,7 @@ class SecureConfig:
             if not self._fernet:
                 raise ValueError("Encryption not initialized. Call initialize_encryption first.")
             
-            with open(self.config_path, 'rb') as f:
-                f.readline()
-                encrypted_data = f.read()
-                if encrypted_data.endswith(b"\n"):
-                    encrypted_data = encrypted_data[:-1]
-                        
-            decrypted_data = self.decrypt_data(encrypted_data)
+            decrypted_data = self.decrypt_data(self._read_encrypted())
             if decrypted_data and not decrypted_data.endswith(b"\n"):
                 decrypted_data += b"\n"
 
@@ -289,6 +288,20 @@ class SecureConfig:
 
         
     
+    def _read_encrypted(self) -> bytes:
+        '''
+        Read the encrypted payload, without the header line and the trailing newline.
+
+        :return: Encrypted data
+        :rtype: bytes
+        '''
+        data = self.config_path.read_bytes().partition(b"\n")[2]
+        if data.endswith(b"\n"):
+            data = data[:-1]
+        return data
+
+
+
     def _edit_save_config(self, config_data: any):
         '''
         Save encrypted data to configuration file.
@@ -326,18 +339,12 @@ class SecureConfig:
                 if not self._fernet:
                     raise ValueError("Encryption not initialized. Call initialize_encryption first.")
                 
-                with open(self.config_path, 'rb') as f:
-                    f.readline()
-                    data = f.read()
-                    if data.endswith(b"\n"):
-                        data = data[:-1]
-                decrypted_data = self.decrypt_data(data)
-                return yaml.safe_load(decrypted_data)
+                decrypted_data = self.decrypt_data(self._read_encrypted())
+                return yaml.load(decrypted_data, Loader=_SafeLoader)
             
             else:
-                with open(self.config_path, 'rb') as f:
-                    data = f.read()
-                return yaml.safe_load(data)
+                data = self.config_path.read_bytes()
+                return yaml.load(data, Loader=_SafeLoader)
         
         except PermissionError as e:
             raise ValueError(f"Cannot access configuration file: {e}") from e
@@ -360,17 +367,11 @@ class SecureConfig:
                 if not self._fernet:
                     raise ValueError("Encryption not initialized. Call initialize_encryption first.")
                 
-                with open(self.config_path, 'rb') as f:
-                    f.readline()
-                    data = f.read()
-                    if data.endswith(b"\n"):
-                        data = data[:-1]
-                decrypted_data = self.decrypt_data(data)
+                decrypted_data = self.decrypt_data(self._read_encrypted())
                 return decrypted_data
             
             else:
-                with open(self.config_path, 'rb') as f:
-                    data = f.read()
+                data = self.config_path.read_bytes()
                 return data
         
         except PermissionError as e:
@@ -435,8 +436,7 @@ class SecureConfig:
         temp_path = self.config_path.with_suffix('.editing.yaml')
         
         try:
-            with open(temp_path, 'wb') as f:
-                f.write(current_config)
+            temp_path.write_bytes(current_config)
             
             os.chmod(temp_path, stat.S_IRUSR | stat.S_IWUSR)
             
@@ -448,10 +448,9 @@ class SecureConfig:
             mtime_after = temp_path.stat().st_mtime
             
             if mtime_after > mtime_before:
-                with open(temp_path, 'rb') as f:
-                    new_config = f.read()
+                new_config = temp_path.read_bytes()
                 try:
-                    yaml.safe_load(new_config)
+                    yaml.load(new_config, Loader=_SafeLoader)
                 except yaml.YAMLError as e:
                     raise ValueError(f"Invalid YAML after editing: {e}")
             